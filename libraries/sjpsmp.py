@@ -1,4 +1,5 @@
 from multiprocessing import Process, Pipe, Value, Queue
+from multiprocessing.connection import wait
 
 
 class PipedProcess:
@@ -11,6 +12,7 @@ class PipedProcess:
     def __init__(self, process, pipe):
         self.process = process
         self.pipe = pipe
+        self.broken_pipe = False # Set when the other end is gone, so later sends can bail out early
 
     @property
     def id(self):
@@ -46,22 +48,32 @@ class PipedProcess:
         return self.pipe.recv()
 
     def send(self, data):
+        if self.broken_pipe:
+            return
         try:
             self.pipe.send(data)
         except BrokenPipeError:
-            pass
+            self.broken_pipe = True
         except Exception as e:
             raise e
     
+    def submit(self, function, *args, **kwargs):
+        """
+        Sends a task to a worker created with create_piped_worker.
+        The function and its arguments must be picklable.
+        The result (or the raised exception) is received with recv.
+        """
+        self.send((function, args, kwargs))
+
     def try_recv(self, default=None):
+        # broken_pipe is not checked here, data sent before the other end closed can still be received
         try:
             if self.poll():
                 return self.recv()
             else:
                 return default
-        except BrokenPipeError:
-            return default
-        except EOFError:
+        except (BrokenPipeError, EOFError):
+            self.broken_pipe = True
             return default
         except Exception:
             raise
@@ -77,6 +89,9 @@ class PipedProcessPool:
 
         self.processes: dict = processes
         self.coms = {}
+        # Pipes are waited on together with multiprocessing.connection.wait
+        self.identifiers: dict = {p.pipe: identifier for identifier, p in processes.items()}
+        self.pipes: list = list(self.identifiers)
     
     def __enter__(self):
         self.start()
@@ -115,28 +130,32 @@ class PipedProcessPool:
                 p.quit()
     
     def poll(self, identifier = None, timeout = 0) -> bool:
-        # See link below for a possibly better solution
-        # https://docs.python.org/3/library/multiprocessing.html?highlight=multiprocessing#multiprocessing.connection.wait
         if identifier is not None:
             if self.processes[identifier].poll(timeout):
                 return True
         else:
-            for p in self.processes.values():
-                if p.poll(timeout):
-                    return True
+            if wait(self.pipes, timeout):
+                return True
         return False
     
     def recv(self, identifier = None, timeout = 0) -> any:
         if identifier is not None:
             return self.processes[identifier].recv()
         else:
-            result = {}
-            for identifier, p in self.processes.items():
-                while p.poll(timeout):
-                    data = result.get(identifier, [])
-                    data.append(p.recv())
-                    result[identifier] = data
-            return result
+            return self.recv_ready(timeout)
+
+    def recv_ready(self, timeout = 0) -> dict:
+        """
+        Receives everything available from all pipes.
+        Returns a dict of identifier => list of received data.
+        """
+        result = {}
+        while (pipes := wait(self.pipes, timeout)):
+            for pipe in pipes:
+                data = result.get(self.identifiers[pipe], [])
+                data.append(pipe.recv())
+                result[self.identifiers[pipe]] = data
+        return result
     
     def send(self, data: any, identifier = None):
         if identifier is not None:
@@ -155,6 +174,9 @@ class PipedProcessPool:
             for p in self.processes.values():
                 p.start()
     
+    def submit(self, identifier, function, *args, **kwargs):
+        self.processes[identifier].submit(function, *args, **kwargs)
+
     def try_recv(self, identifier = None, timeout = 0) -> any:
         if identifier is not None:
             if self.processes[identifier].poll(timeout):
@@ -162,13 +184,7 @@ class PipedProcessPool:
             else:
                 return None
         else:
-            result = {}
-            for identifier, p in self.processes.items():
-                while p.poll(timeout):
-                    data = result.get(identifier, [])
-                    data.append(p.recv())
-                    result[identifier] = data
-            return result or None
+            return self.recv_ready(timeout) or None
     
     def try_send(self, data: any, identifier = None):
         if identifier is not None:
@@ -205,3 +221,37 @@ def spawn_piped_process(function, *args, **kwargs) -> PipedProcess:
     p = create_piped_process(function, *args, **kwargs)
     p.start()
     return p
+
+
+def _piped_worker(pipe):
+    """
+    Runs (function, args, kwargs) tasks received from the pipe and sends back the results.
+    Exceptions raised by a task are sent back instead of a result.
+    Stops when None is received or the pipe is closed.
+    Used exclusively by create_piped_worker.
+    """
+    try:
+        while (task := pipe.recv()) is not None:
+            function, args, kwargs = task
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                result = e
+            pipe.send(result)
+    except (EOFError, KeyboardInterrupt):
+        pass
+
+
+def create_piped_worker() -> PipedProcess:
+    """
+    Creates a long-lived PipedProcess that runs tasks sent with PipedProcess.submit.
+    Reusing a worker for many tasks avoids starting a new process per task.
+    Send None to stop the worker.
+    """
+    return create_piped_process(_piped_worker)
+
+
+def spawn_piped_worker() -> PipedProcess:
+    p = create_piped_worker()
+    p.start()
+    return p
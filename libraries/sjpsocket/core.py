@@ -1,36 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 from json import loads, JSONDecodeError
 from mimetypes import guess_type
 from pathlib import Path
-from re import compile as compile_regex
-from select import select
+from re import compile as compile_regex, escape as escape_regex
+from selectors import DefaultSelector, EVENT_READ
 from socket import socket, SOL_SOCKET, SO_REUSEADDR
-from urllib.parse import unquote_plus
+from urllib.parse import parse_qsl, unquote_plus
 
-from sjpsmp import spawn_piped_process
 
+CLIENT_LOOP_TIMEOUTS = (0, 0, 0, 0.0005, 0.005, 0.05) # Backoff in seconds, indexed by idle ticks
+HTTP_COOKIE_REGEX = compile_regex(r'([^=]+?)=(.*?)(?:; |$)')
+HTTP_HEADER_END_REGEX = compile_regex(rb'\r\n\r\n')
+HTTP_HEADER_LINE_REGEX = compile_regex(rb'\r\n([^:\r\n]+):[ \t]*([^\r\n]*)')
+HTTP_REQUEST_LINE_REGEX = compile_regex(rb'(GET|POST|PUT|DELETE|HEAD)\s([\/\w\S]+)\s(HTTP\/\d\.\d)')
+HTTP_STATUS_CODES = frozenset(status.value for status in HTTPStatus)
+REGEX_GROUP_NAME_REGEX = compile_regex(r'\(\?P<(\w+)>')
 
-def build_http_response(status: [HTTPStatus, int], headers: dict, body: str) -> bytes:
+
+class HttpBodyReader:
+
+    """
+    Reads the body of an HTTP request from the client socket on demand.
+    Data received together with the request head is returned first.
+    Reading stops after content_length bytes, then read returns b''.
+    If content_length is None, reading stops when the client stops sending.
+    Reads wait up to timeout seconds for data. The wait uses a selector, so the socket itself
+    stays blocking without a timeout for sending the response.
+    """
+
+    def __init__(self, sock, received: bytes, content_length: int = None, timeout: float = 0.1):
+        self.sock = sock
+        self.received = memoryview(received)
+        self.remaining = content_length
+        self.timeout = timeout
+        self.selector = None # Created on the first read from the socket, closed at the end of the body
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Reads up to size bytes of the body, or the rest of the body if size is negative.
+        Returns b'' at the end of the body.
+        """
+
+        if size < 0:
+            chunks = []
+            while (chunk := self.read(8192)):
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+
+        if not size:
+            return b''
+
+        if self.received:
+            data = bytes(self.received[:size])
+            self.received = self.received[size:]
+
+        else:
+            if not self.selector:
+                self.selector = DefaultSelector()
+                self.selector.register(self.sock, EVENT_READ)
+            data = self.sock.recv(size) if self.selector.select(self.timeout) else b''
+
+        # The client may close the connection (or stop sending) before the whole body is sent
+        if not data:
+            self.remaining = 0
+        elif self.remaining is not None:
+            self.remaining -= len(data)
+
+        if self.remaining == 0 and self.selector:
+            self.selector.close()
+            self.selector = None
+
+        return data
+
+
+class RegexRouter:
+
+    """
+    Matches a path against all routes with a single combined regex.
+    routes should be a dictionary where keys are URL paths (see build_regex_url) and
+    values are anything, usually handlers. The first matching route wins, as when
+    iterating the routes in order.
+    """
+
+    def __init__(self, routes: dict, prefix: str = ':'):
+        self.routes: list = []
+        alternatives: list = []
+
+        for i, (url, value) in enumerate(routes.items()):
+            regex = build_regex_url(url, prefix)
+            # Group names are namespaced per route, so routes may share variable names
+            pattern = REGEX_GROUP_NAME_REGEX.sub(f'(?P<_r{i}_\\1>', regex.pattern[1:-1])
+            alternatives.append(f'(?P<_r{i}>{pattern})')
+            self.routes.append((value, {name: f'_r{i}_{name}' for name in regex.groupindex}))
+
+        self.regex = compile_regex('^(?:' + '|'.join(alternatives) + ')$') if alternatives else None
+
+    def match(self, path: str) -> tuple:
+        """
+        Returns a tuple of the matching route's value and its path variables (dict).
+        Returns None if no route matches.
+        """
+        if self.regex and (match := self.regex.match(path)):
+            # The route group is the last one to close, so lastgroup identifies the route
+            value, groups = self.routes[int(match.lastgroup[2:])]
+            return value, {name: match.group(group) for name, group in groups.items()}
+        return None
+
+
+def build_http_response(status: [HTTPStatus, int], headers: dict, body: [str, bytes]) -> bytes:
     """
     Returns a bytes object representing an HTTP response.
     status should be an http.HTTPStatus object or an int representing an HTTP status code.
+    body can be a str (encoded as UTF-8) or an already encoded bytes object.
     """
 
-    r: str = 'HTTP/1.1 '
+    return build_http_response_head(status, headers) + (body if type(body) is bytes else body.encode())
 
-    if type(status) is HTTPStatus:
-        code = status.value
-        phrase = status.phrase
 
-    else:
-        code = status
-        phrase = get_http_status_code_phrase(code)
+def build_http_response_head(status: [HTTPStatus, int], headers: dict) -> bytes:
+    """
+    Returns a bytes object with the status line and headers of an HTTP response,
+    including the empty line that ends the head. The body can be sent separately after it.
+    """
+
+    if type(status) is not HTTPStatus:
+        status = HTTPStatus(status)
 
-    r += f'{code} {phrase}\r\n'
-    r += '\r\n'.join(f'{key}: {value}' for key, value in headers.items())
-    r += ('\r\n' if r.endswith('\r\n') else '\r\n\r\n') + body
+    parts = [f'HTTP/1.1 {status.value} {status.phrase}\r\n'.encode()]
+    parts.extend(f'{key}: {value}\r\n'.encode() for key, value in headers.items())
+    parts.append(b'\r\n')
 
-    return bytes(r, encoding='UTF-8')
+    return b''.join(parts)
 
 
 def build_regex_url(url: str, prefix: str = ':') -> object:
@@ -41,31 +145,33 @@ def build_regex_url(url: str, prefix: str = ':') -> object:
 
     url format:
         /path/to/some/page      =>      ^/path/to/some/page$
-        /countries/:country     =>      ^/countries/(?P<country>\w+)$
+        /countries/:country     =>      ^/countries/(?P<country>[^/]+)$
     
     etc.
     """
 
-    r: str = '^'
+    fragments: list = ['^']
 
-    if len(url) == 1:
-        r += url
+    for part in url.split('/'):
+        if part:
+            if part.startswith(prefix):
+                fragments.append(f'/(?P<{part[1:]}>[^/]+)')
+            else:
+                fragments.append('/' + escape_regex(part))
 
-    else:
-        parts = url.split('/')
-        for part in parts:
-            if part:
-                if part.startswith(prefix):
-                    r += f'/(?P<{part[1:]}>\w+)'
-                else:
-                    r += '/' + part
+    if len(fragments) == 1:
+        fragments.append('/')
 
-    return compile_regex(r + '$')
+    fragments.append('$')
+
+    return compile_regex(''.join(fragments))
 
 
 def client_loop(host: str = 'localhost', port: int = 8080, **socket_options):
     """
     Runs a socket server and accepts connections.
+    Uses selectors.DefaultSelector (epoll/kqueue where available) to wait for connections.
+    The wait time backs off while idle (see CLIENT_LOOP_TIMEOUTS) and resets on a new connection.
     Yields a client if a client is trying to connect.
     Otherwise yields None.
     Runs forever.
@@ -73,23 +179,26 @@ def client_loop(host: str = 'localhost', port: int = 8080, **socket_options):
 
     try:
 
-        with socket(**socket_options) as server:
+        with socket(**socket_options) as server, DefaultSelector() as selector:
 
             server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
             server.bind((host, port))
             server.listen()
-            read_list = [server]
+            selector.register(server, EVENT_READ)
+            idle_ticks = 0
 
             while True:
                 
-                # timeout is set (0.05, 50 ms) to help with SIGINT, otherwise blocks
-                readables = select(read_list, [], [], 0.05)[0]
+                # timeout backs off from 0 up to 0.05 (50 ms) while idle to help with SIGINT, otherwise blocks
+                events = selector.select(CLIENT_LOOP_TIMEOUTS[idle_ticks])
                 
-                if readables:
-                    for readable in readables:
+                if events:
+                    idle_ticks = 0
+                    for key, mask in events:
                         yield server.accept()[0]
                 
                 else:
+                    idle_ticks = min(idle_ticks + 1, len(CLIENT_LOOP_TIMEOUTS) - 1)
                     yield None
 
     except KeyboardInterrupt:
@@ -102,12 +211,10 @@ def client_loop(host: str = 'localhost', port: int = 8080, **socket_options):
 def get_http_status_code_phrase(code: int) -> str:
     """Returns a string representation of an HTTP status code"""
 
-    if not code in list(HTTPStatus):
+    if code not in HTTP_STATUS_CODES:
         raise Exception(f'HTTP response code "{code}" is not valid!')
 
-    for status in list(HTTPStatus):
-        if status.value == code:
-            return status.phrase
+    return HTTPStatus(code).phrase
 
 
 def get_mime_type(url: str) -> str:
@@ -120,57 +227,54 @@ def get_parent_dir(url: str) -> str:
     return str(Path(url).parent)
 
 
-def http_client_request_loop(host: str = 'localhost', port: int = 8080, **socket_options):
+def http_client_request_loop(host: str = 'localhost', port: int = 8080, stream_body: bool = False, **socket_options):
     """
     NOTE: Not for production! (yet)
     Runs a socket server that parses HTTP requests.
     Yields clients (socket) and HTTP requests (dict).
+    If stream_body is True, only the request head is read before yielding and the body is
+    left unparsed. It can be read from request['body_io'] (HttpBodyReader) instead.
     Automatically closes the client socket.
     Runs forever.
     WARNING: Blocks new connections when reading data.
     """
     for client in client_loop(host, port, **socket_options):
         if client:
-            if (data := recv_all(client)):
+            if stream_body:
+                if (request := recv_http_request_head(client)):
+                    yield client, request
+            elif (data := recv_all(client)):
                 yield client, parse_http_request(data)
             client.close()
 
 
-def _piped_process_recv_all(pipe, sock, data_limit):
-        """
-        Reads all data from a socket.
-        Sends the received data in the pipe.
-        Used exclusively by http_client_request_loop_async.
-        """
-        data = recv_all(sock, data_limit)
-        pipe.send(data)
-
-
-def http_client_request_loop_async(host: str = 'localhost', port: int = 8080, data_limit: int = 16_000, **socket_options):
+def http_client_request_loop_async(host: str = 'localhost', port: int = 8080, data_limit: int = 16_000,
+                                   max_workers: int = 64, **socket_options):
     """
     NOTE: NOT FOR PRODUCTION!
     Runs a socket server that parses HTTP requests.
-    Connected clients are read from in a sjpsmp.PipedProcess instance.
+    Connected clients are read from in a persistent thread pool of max_workers threads.
     Yields clients (socket) and HTTP requests (dict).
     Automatically closes the client socket.
     Runs forever.
-    NOTE: Must be called in if __name__ == '__main__' block.
     TODO: File uploads really slow / don't work for slightly larger files
     """
 
-    clients = []
+    clients = {} # client socket FD => (client, future)
 
-    for client in client_loop(host, port, **socket_options):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
 
-        if client:
-            clients.append((client, spawn_piped_process(_piped_process_recv_all, client, data_limit)))
+        for client in client_loop(host, port, **socket_options):
 
-        for c, p in clients:
-            if not p.is_alive():
-                if (data := p.try_recv()):
-                    yield c, parse_http_request(data)
-                c.close()
-                clients.remove((c, p))
+            if client:
+                clients[client.fileno()] = (client, executor.submit(recv_all, client, 8192, data_limit))
+
+            for fd, (c, f) in list(clients.items()):
+                if f.done():
+                    del clients[fd]
+                    if (data := f.result()):
+                        yield c, parse_http_request(data)
+                    c.close()
 
 
 def is_file_url(url: str) -> bool:
@@ -180,12 +284,11 @@ def is_file_url(url: str) -> bool:
 
 def is_http_request(data: bytes) -> bool:
     """Checks whether a received message is an HTTP request"""
-    header_row = data.split(b'\r\n', 1)[0].decode()
-    regex = compile_regex(r'(GET|POST|PUT|DELETE|HEAD)\s([\/\w\S]+)\s(HTTP\/\d\.\d)')
-    return bool(regex.match(header_row))
+    header_row = data.split(b'\r\n', 1)[0]
+    return bool(HTTP_REQUEST_LINE_REGEX.match(header_row))
 
 
-def parse_form_multipart_form_data(body_section: bytes, content_type: str) -> dict:
+def parse_form_multipart_form_data(body_section: [bytes, memoryview], content_type: str) -> dict:
     """
     Parses multipart/form-data body of an HTTP request.
     Files are always inserted into a list object.
@@ -201,39 +304,47 @@ def parse_form_multipart_form_data(body_section: bytes, content_type: str) -> di
     r: dict = {}
     items: list = []
     content_type, boundary_string = content_type.split('; ', 1)
-    boundary = boundary_string.split('=', 1)[1]
-    for part in body_section.split(bytes('--' + boundary, 'utf-8'))[1:-1]:
-        meta, data = part.lstrip().split(b'\r\n\r\n', 1)
-        meta = meta.replace(b'\r\n', b'; ').replace(b': ', b'=').replace(b'"', b'')
-        item: dict = {'data': data[:-2]}
-        for pair in meta.split(b'; '):
-            key, value = pair.split(b'=', 1)
+    delimiter = compile_regex(escape_regex(b'--' + boundary_string.split('=', 1)[1].encode()))
+    view = memoryview(body_section)
+    # Regex search works on any bytes-like object, so the body is never copied while searching
+    boundaries = [(match.start(), match.end()) for match in delimiter.finditer(view)]
+
+    for (_, start), (end, _) in zip(boundaries, boundaries[1:]):
+
+        if not (separator := HTTP_HEADER_END_REGEX.search(view, start, end)):
+            continue
+
+        # Part data is sliced from the view to avoid copying the payload until it is stored
+        item: dict = {'data': view[separator.end():end - 2]}
+
+        for line in bytes(view[start:separator.start()]).strip().split(b'\r\n'):
+            key, value = line.split(b': ', 1)
+            value, *parameters = value.split(b'; ')
             item[key.decode()] = value.decode()
+            for parameter in parameters:
+                key, value = parameter.split(b'=', 1)
+                item[key.decode()] = value.strip(b'"').decode()
+
         items.append(item)
-    
+
     for item in items:
         if 'name' in item:
             if 'filename' in item and 'Content-Type' in item:
                 if item['name'] not in r:
                     r[item['name']] = []
-                r[item['name']].append({'type': item['Content-Type'], 'name': item['filename'], 'data': item['data']})
+                r[item['name']].append({'type': item['Content-Type'], 'name': item['filename'], 'data': bytes(item['data'])})
             else:
-                r[item['name']] = item['data'].decode()
+                r[item['name']] = str(item['data'], 'UTF-8')
 
     return r
 
 
-def parse_form_urlencoded(body_section: bytes) -> dict:
+def parse_form_urlencoded(body_section: [bytes, memoryview]) -> dict:
     """Parses application/x-www-form-urlencoded body of an HTTP request"""
-    r: dict = {}
-    for pair in body_section.decode().split('&'):
-        if pair:
-            key, value = pair.split('=', 1)
-            r[unquote_plus(key)] = unquote_plus(value)
-    return r
+    return dict(parse_qsl(str(body_section, 'UTF-8'), keep_blank_values=True))
 
 
-def parse_http_body(body_section: bytes, content_type: str = 'text/plain') -> dict:
+def parse_http_body(body_section: [bytes, memoryview], content_type: str = 'text/plain') -> dict:
     """
     Parses the body of a request to a dict object.
     content_type defines how the body is parsed.
@@ -254,10 +365,10 @@ def parse_http_body(body_section: bytes, content_type: str = 'text/plain') -> di
         
         else: # Possibly JSON
             try:
-                r = loads(body_section.decode())
+                r = loads(str(body_section, 'UTF-8'))
             except JSONDecodeError:
                 print('Failed to parse HTTP body:')
-                print(body_section)
+                print(bytes(body_section))
 
     return r
 
@@ -269,23 +380,15 @@ def parse_http_cookies(cookie_string: str) -> dict:
     Returns a dictionary.
     """
 
-    r: dict = {}
-    pairs = cookie_string.split('; ')
-
-    for pair in pairs:
-        if pair:
-            key, value = pair.split('=', 1)
-            r[key] = value
-
-    return r
+    return dict(HTTP_COOKIE_REGEX.findall(cookie_string))
 
 
 def parse_http_headers(header_section: bytes) -> dict:
     """Parse the header section of an HTTP request"""
 
     r: dict = {}
-    headers = header_section.decode().split('\r\n')
-    method, path_with_parameters, http_version = headers[0].split()
+    request_line = header_section.split(b'\r\n', 1)[0]
+    method, path_with_parameters, http_version = request_line.decode().split()
 
     if '?' in path_with_parameters:
         path, parameter_string = path_with_parameters.split('?', 1)
@@ -300,9 +403,8 @@ def parse_http_headers(header_section: bytes) -> dict:
     r['path'] = unquote_plus(path)
     r['parameters'] = parameters
 
-    for header in headers[1:]:
-        key, value = header.split(': ', 1)
-        r[key.lower()] = value
+    for match in HTTP_HEADER_LINE_REGEX.finditer(header_section, len(request_line)):
+        r[match[1].decode().lower()] = match[2].decode()
 
     if 'cookie' in r:
         r['cookie'] = parse_http_cookies(r['cookie'])
@@ -315,8 +417,12 @@ def parse_http_request(data: bytes) -> dict:
 
     if not is_http_request(data):
         raise Exception(f'Not an HTTP request!\nType={type(data)}\n{data}')
-    header_section, body_section = data.split(b'\r\n\r\n', 1)
-    
+
+    # Only the small header section is copied, the body is passed on as a memoryview
+    header_end = data.index(b'\r\n\r\n')
+    header_section = data[:header_end]
+    body_section = memoryview(data)[header_end + 4:]
+
     headers = parse_http_headers(header_section)
     body = parse_http_body(body_section, headers.get('content-type', 'text/plain'))
 
@@ -324,35 +430,81 @@ def parse_http_request(data: bytes) -> dict:
 
 
 def parse_url_parameters(parameter_string: str) -> dict:
-    """Parses URL parameters to a dict object"""
-
-    r: dict = {}
-    parameter_string = unquote_plus(parameter_string)
-
-    for pair in parameter_string.split('&'):
-        key, value = pair.split('=', 1)
-        r[key] = value
-
-    return r
+    """
+    Parses URL parameters to a dict object.
+    Keys and values are decoded separately, so encoded & and = characters are kept.
+    """
+    return dict(parse_qsl(parameter_string, keep_blank_values=True))
 
 
 def recv_all(sock, buffer_size: int = 8192, data_limit: int = None, timeout: float = 0.1) -> bytes:
     """
     Read all data from socket until nothing can be read.
-    Utilizes select.select to deduce readability.
+    Utilizes selectors.DefaultSelector to deduce readability.
+    Stops early if the peer closes the connection.
     Returns bytes.
     """
 
-    data: bytes = b''
+    data = bytearray()
 
     try:
-        while (readables := select([sock], [], [], timeout)[0]):
-            data += readables[0].recv(buffer_size)
-            if data_limit:
-                if len(data) >= data_limit:
+        with DefaultSelector() as selector:
+            selector.register(sock, EVENT_READ)
+            while selector.select(timeout):
+                if not (chunk := sock.recv(buffer_size)):
                     break
+                data.extend(chunk)
+                if data_limit:
+                    if len(data) >= data_limit:
+                        break
 
     except KeyboardInterrupt:
         pass
 
-    return data
+    return bytes(data)
+
+
+def recv_http_request_head(sock, buffer_size: int = 8192, timeout: float = 0.1) -> dict:
+    """
+    Reads an HTTP request from socket up to the end of its headers.
+    The body is not read, request['body'] is empty and request['body_io'] is an
+    HttpBodyReader that reads the body from the socket.
+    timeout applies to each read, including the reads made by the body reader.
+    Returns None if the request head could not be read or its Content-Length is invalid.
+    """
+
+    data = bytearray()
+
+    try:
+        with DefaultSelector() as selector:
+            selector.register(sock, EVENT_READ)
+            while (header_end := data.find(b'\r\n\r\n')) == -1:
+                if not selector.select(timeout) or not (chunk := sock.recv(buffer_size)):
+                    return None
+                data.extend(chunk)
+
+    except KeyboardInterrupt:
+        return None
+
+    data = bytes(data)
+
+    if not is_http_request(data):
+        raise Exception(f'Not an HTTP request!\nType={type(data)}\n{data}')
+
+    headers = parse_http_headers(data[:header_end])
+
+    if 'content-length' in headers:
+        # A malformed Content-Length makes the body impossible to frame, so the request is dropped
+        try:
+            content_length = int(headers['content-length'])
+        except ValueError:
+            return None
+        if content_length < 0:
+            return None
+    else:
+        # Without a Content-Length, a POST or PUT body lasts until the client stops sending
+        content_length = None if headers['method'] in ('POST', 'PUT') else 0
+
+    body_io = HttpBodyReader(sock, data[header_end + 4:], content_length, timeout)
+
+    return {**headers, 'body': {}, 'body_io': body_io}
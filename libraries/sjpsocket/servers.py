@@ -1,26 +1,35 @@
 from sjpsocket.core import (
-    build_http_response, build_regex_url, get_mime_type, get_parent_dir,
-    http_client_request_loop, is_file_url, parse_http_request
+    build_http_response, build_http_response_head, build_regex_url, get_mime_type, get_parent_dir,
+    http_client_request_loop, is_file_url, parse_http_body, parse_http_request, RegexRouter
 )
 
 from sjpsunits import Size
 
-from asyncio import run, start_server, TimeoutError, wait_for
+from asyncio import create_task, get_running_loop, run, TimeoutError, wait_for
+from collections import deque
 from http import HTTPStatus
 from inspect import signature, _empty
 from json import dumps
-from os import listdir
-from os.path import exists, join
-from socket import AF_INET, SO_REUSEADDR
+from os import listdir, stat
+from os.path import exists, getsize, join
+from re import compile as compile_regex, IGNORECASE
+from socket import AF_INET, SO_REUSEADDR, SOCK_STREAM, socket, SOL_SOCKET
 from types import FunctionType
 from urllib.parse import unquote_plus
 
 
+CHUNKED_REGEX = compile_regex(rb'\r\ntransfer-encoding:[^\r\n]*chunked', IGNORECASE)
+CONTENT_LENGTH_REGEX = compile_regex(rb'\r\ncontent-length:[ \t]*([^\r\n]*)', IGNORECASE)
+FILE_NOT_FOUND_BODY = b'File not found'
+NOT_FOUND_BODY = b'404 NOT FOUND'
+SENDMSG_SUPPORTED = hasattr(socket, 'sendmsg') # Not available on Windows
+
+
 class AsyncHttpServer:
 
     def __init__(self, host: str = 'localhost', port: int = 8080, request_handler: FunctionType = None,
-                 request_max_size: int = 500 * Size.megabyte, request_buffer_size: int = 4 * Size.kilobyte,
-                 request_timeout: float = 0.5):
+                 request_max_size: int = 500 * Size.mebibyte, request_buffer_size: int = 4 * Size.kibibyte,
+                 request_timeout: float = 0.5, buffer_pool_size: int = 1024):
         
         self.host = host
         self.port = port
@@ -29,66 +38,231 @@ class AsyncHttpServer:
         self.request_max_size = request_max_size
         self.request_buffer_size = request_buffer_size
         self.request_timeout = request_timeout
-        
 
-    async def read_all(self, reader) -> bytes:
+        # Request buffers are reused between connections to avoid allocating them per request
+        self.buffer_capacity = 4 * request_buffer_size
+        self.buffer_pool = deque()
+        self.buffer_pool_size = buffer_pool_size
 
-        # TODO: Use selectors to read from the client socket instead! (to avoid timeout)
+        # Client tasks are referenced until they finish so they are not garbage collected mid-request
+        self.client_tasks = set()
+
+
+    def get_buffer(self):
+        """Returns a RequestBuffer from the pool, or a new one if the pool is empty"""
+        return self.buffer_pool.pop() if self.buffer_pool else RequestBuffer(self.buffer_capacity)
+
+
+    def release_buffer(self, buffer):
+        """
+        Returns a RequestBuffer to the pool.
+        Buffers grown past their initial capacity are dropped, so the pool never holds more than
+        buffer_pool_size preallocated buffers worth of memory.
+        """
+        buffer.clear()
+        if len(self.buffer_pool) < self.buffer_pool_size and buffer.capacity == self.buffer_capacity:
+            self.buffer_pool.append(buffer)
+
+
+    async def read_more(self, client, buffer) -> bool:
+        """
+        Reads the next piece of data from the client directly into buffer.
+        Returns False if the client closed the connection or the request grew too large.
+        Raises TimeoutError if nothing was received within request_timeout.
+        """
+
+        loop = get_running_loop()
+
+        # The view is released before the buffer is grown again, resizing a bytearray with live views fails
+        with buffer.reserve(self.request_buffer_size) as view:
+            size = await wait_for(loop.sock_recv_into(client, view), self.request_timeout)
+
+        if not size or buffer.size + size > self.request_max_size:
+            return False
+
+        buffer.size += size
+        return True
+
+
+    async def read_chunked_body(self, client, buffer, position: int) -> bytes:
+        """
+        Reads a chunked transfer encoded body starting at position in buffer.
+        Returns the decoded body or None if the body ended prematurely or is malformed.
+        """
+
+        body = bytearray()
+
+        while True:
+
+            while (line_end := buffer.find(b'\r\n', position)) == -1:
+                if not await self.read_more(client, buffer):
+                    return None
+
+            try:
+                size = int(buffer.data[position:line_end].split(b';', 1)[0], 16)
+            except ValueError: # Malformed chunk size
+                return None
+
+            position = line_end + 2
+
+            if size == 0:
+                # Skip optional trailers, the body ends with an empty line
+                while buffer.find(b'\r\n\r\n', line_end) == -1:
+                    if not await self.read_more(client, buffer):
+                        return None
+                return bytes(body)
+
+            while buffer.size < position + size + 2:
+                if not await self.read_more(client, buffer):
+                    return None
+
+            body.extend(buffer.view(position, position + size))
+            position += size + 2
+
+
+    async def read_all(self, client) -> bytes:
+        """
+        Reads a single HTTP request from the client.
+        The end of the request is detected from the Content-Length header or chunked transfer encoding,
+        chunked bodies are returned decoded. Requests without either have no body.
+        request_timeout limits how long to wait for each piece of data.
+        Returns None if the request is incomplete, malformed or larger than request_max_size.
+        """
+
+        buffer = self.get_buffer()
 
-        result: bytes = bytes()
-        
         try:
 
-            while True:
+            while (header_end := buffer.find(b'\r\n\r\n')) == -1:
+                if not await self.read_more(client, buffer):
+                    return None
 
-                data = await wait_for(reader.read(self.request_buffer_size), self.request_timeout)
+            body_start = header_end + 4
 
-                if len(result) + len(data) <= self.request_max_size:
-                    result += data
-                else:
-                    # Return None to avoid processing the request
+            if CHUNKED_REGEX.search(buffer.data, 0, header_end):
+                if (body := await self.read_chunked_body(client, buffer, body_start)) is None:
                     return None
+                return bytes(buffer.view(0, body_start)) + body
+
+            content_length = 0
+
+            if (match := CONTENT_LENGTH_REGEX.search(buffer.data, 0, header_end)):
+                try:
+                    content_length = int(match[1])
+                except ValueError: # Malformed Content-Length
+                    return None
+
+            # Requests declaring a negative or too large body are dropped before reading it
+            if content_length < 0 or body_start + content_length > self.request_max_size:
+                return None
+
+            while buffer.size < body_start + content_length:
+                if not await self.read_more(client, buffer):
+                    return None
+
+            return bytes(buffer.view(0, body_start + content_length))
 
         except TimeoutError:
-            pass
+            return None
 
-        return result
+        finally:
+            self.release_buffer(buffer)
 
 
-    async def handle_client(self, reader, writer):
+    async def handle_client(self, client):
 
-        if (data := await self.read_all(reader)):
-            request = parse_http_request(data)
-            response = self.request_handler(request)
-            writer.write(response)
-            await writer.drain()
+        # The connection is closed even if the request is dropped or handling it fails
+        try:
+            if (data := await self.read_all(client)):
+                request = parse_http_request(data)
+                response = self.request_handler(request)
+                await get_running_loop().sock_sendall(client, response)
 
-        writer.close()
+        finally:
+            client.close()
 
 
     async def server_loop(self):
 
-        server = await start_server(
-            self.handle_client, self.host, self.port, family=AF_INET,
-            reuse_address=SO_REUSEADDR
-        )
+        # Clients are served from plain non-blocking sockets instead of asyncio streams,
+        # so that requests can be received straight into the pooled buffers with sock_recv_into
+        loop = get_running_loop()
+
+        with socket(AF_INET, SOCK_STREAM) as server:
 
-        async with server:
-            await server.serve_forever()
+            server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            server.bind((self.host, self.port))
+            server.listen()
+            server.setblocking(False)
+
+            while True:
+                client, _ = await loop.sock_accept(server)
+                task = create_task(self.handle_client(client))
+                self.client_tasks.add(task)
+                task.add_done_callback(self.client_tasks.discard)
 
 
     def start(self):
+        """
+        Runs the server until interrupted.
+        Uses uvloop as the event loop if it is installed, otherwise the default asyncio loop.
+        """
+        try:
+            from uvloop import install
+            install()
+        except ImportError:
+            pass
         try:
             run(self.server_loop())
         except KeyboardInterrupt:
             pass
 
 
-def file_server(root_directory: str, port: int = 8080):
-    """Serves files from root_directory on specified port"""
+class RequestBuffer:
+
+    """
+    A preallocated buffer that requests are read into.
+    Only data[:size] is in use, so a cleared buffer keeps its memory and can be reused.
+    """
+
+    def __init__(self, capacity: int):
+        self.data = bytearray(capacity)
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.data)
+
+    def clear(self):
+        self.size = 0
+
+    def find(self, sub: bytes, start: int = 0) -> int:
+        return self.data.find(sub, start, self.size)
+
+    def reserve(self, length: int) -> memoryview:
+        """Returns a writable view of the length bytes after data[:size], growing the buffer if needed"""
+        end = self.size + length
+        if end > self.capacity:
+            # Grow at least by doubling, so filling the buffer stays linear
+            self.data.extend(bytes(max(end, 2 * self.capacity) - self.capacity))
+        return memoryview(self.data)[self.size:end]
+
+    def view(self, start: int = 0, end: int = None) -> memoryview:
+        return memoryview(self.data)[start:self.size if end is None else end]
+
+
+def file_server(root_directory: str, port: int = 8080, cache_size: int = 128, cache_file_size: int = Size.mebibyte):
+    """
+    Serves files from root_directory on specified port.
+    Up to cache_size responses are kept in memory and reused until the file
+    (or directory, for listings) is modified.
+    Files larger than cache_file_size are not cached, they are streamed with send_file instead.
+    """
 
     assert exists(root_directory)
 
+    cache = {} # path => ((modification time, size), response)
+
     for client, request in http_client_request_loop(port=port):
 
         headers = {'Connection': 'close'}
@@ -96,32 +270,107 @@ def file_server(root_directory: str, port: int = 8080):
 
         if exists(path):
 
-            status = HTTPStatus.OK
+            path_stat = stat(path)
+            version = (path_stat.st_mtime_ns, path_stat.st_size)
 
-            if is_file_url(path):
-                body = open(path).read()
+            if is_file_url(path) and path_stat.st_size > cache_file_size:
+                response = None
                 headers['Content-Type'] = get_mime_type(path)
+                send_file(client, path, headers, path_stat.st_size)
+
+            elif (cached := cache.get(path)) and cached[0] == version:
+                response = cached[1]
 
             else:
-                body = '<meta charset="UTF-8"/>'
-                body += f'<h2>Files in {request["path"]}</h2><hr/>'
-                headers['Content-Type'] = 'text/html'
-                for file in listdir(path):
-                    body += f'<a href="{join(request["path"], file)}">{file}</a><br/>'
-                body += '<br/><hr/>'
-                if request['path'] != '/':
-                    parent = get_parent_dir(request['path'])
-                    body += f'<a href="{parent}">&lt;&lt;</a>'
+
+                if is_file_url(path):
+                    with open(path, 'rb') as file:
+                        body = file.read()
+                    headers['Content-Type'] = get_mime_type(path)
+
+                else:
+                    parts = ['<meta charset="UTF-8"/>', f'<h2>Files in {request["path"]}</h2><hr/>']
+                    headers['Content-Type'] = 'text/html'
+                    for file in listdir(path):
+                        parts.append(f'<a href="{join(request["path"], file)}">{file}</a><br/>')
+                    parts.append('<br/><hr/>')
+                    if request['path'] != '/':
+                        parent = get_parent_dir(request['path'])
+                        parts.append(f'<a href="{parent}">&lt;&lt;</a>')
+                    body = ''.join(parts).encode()
+
+                headers['Content-Length'] = len(body)
+                response = build_http_response(HTTPStatus.OK, headers, body)
+
+                # A stale entry of the same path is replaced, only new paths need room
+                if path not in cache and len(cache) >= cache_size:
+                    del cache[next(iter(cache))] # Evict the oldest entry
+                cache[path] = (version, response)
 
         else:
-            body = '404 NOT FOUND'
-            status = HTTPStatus.NOT_FOUND
+            headers['Content-Length'] = len(NOT_FOUND_BODY)
+            response = build_http_response(HTTPStatus.NOT_FOUND, headers, NOT_FOUND_BODY)
 
-        response = build_http_response(status, headers, body)
-        client.send(response)
+        if response:
+            client.sendall(response)
         client.close()
 
 
+def get_parameter_binder(function) -> FunctionType:
+    """
+    Returns a function that picks the parameters of function from a dict of client parameters
+    and converts them with the parameter annotations. Parameters the function does not accept are left out.
+    The signature is inspected once here instead of on every request.
+    """
+
+    types = get_parameter_types(function) # parameter name => converter, or None to pass the value as is
+
+    def bind(parameters: dict) -> dict:
+        kwargs = {}
+        # Usually fewer parameters are provided than the view accepts
+        for name, value in parameters.items():
+            if name in types:
+                kwargs[name] = value if (convert := types[name]) is None else convert(value)
+        return kwargs
+
+    return bind
+
+
+def get_parameter_types(function) -> dict:
+    """
+    Returns a dict of the parameter names of function and their annotations.
+    Parameters without an annotation map to None.
+    """
+
+    try:
+        func_sig = signature(function)
+    except ValueError as error:
+        raise Exception('Missing self in view method!')
+
+    return {
+        name: None if param.annotation is _empty else param.annotation
+        for name, param in func_sig.parameters.items()
+    }
+
+
+def read_cached_file(path: str, cache: dict, cache_size: int = 128) -> tuple:
+    """
+    Returns the contents (bytes) and the mime type of the file in path.
+    Files are stored in cache (a dict) and read from disk again only when modified.
+    Up to cache_size files are kept, the oldest one is evicted to make room for a new one.
+    """
+
+    modified = stat(path).st_mtime_ns
+
+    if not (cached := cache.get(path)) or cached[0] != modified:
+        if not cached and len(cache) >= cache_size:
+            del cache[next(iter(cache))] # Evict the oldest entry
+        with open(path, 'rb') as file:
+            cached = cache[path] = (modified, file.read(), get_mime_type(path))
+
+    return cached[1], cached[2]
+
+
 def redirect(url: str, timeout: int = 0, body: str = '', **options) -> tuple:
     """Returns a tuple with response data to redirect"""
     return (HTTPStatus.SEE_OTHER, {'Refresh': f'{timeout}; url={url}'}, body)
@@ -132,10 +381,51 @@ def respond(status: [HTTPStatus, int] = HTTPStatus.OK, headers: dict = {}, body:
     return (status, headers, body)
 
 
-def single_page_application_server(root_directory: str, port: int = 8080, urls: dict = {}):
+def send_file(client, path: str, headers: dict, size: int = None):
+    """
+    Sends a 200 OK response with the file in path as the body.
+    The headers are sent first and the file is then streamed with socket.sendfile,
+    which avoids copying the file through Python where the platform supports it.
+    """
+
+    headers['Content-Length'] = getsize(path) if size is None else size
+    client.sendall(build_http_response_head(HTTPStatus.OK, headers))
+
+    with open(path, 'rb') as file:
+        client.sendfile(file)
+
+
+def send_response(client, status: [HTTPStatus, int], headers: dict, body: [str, bytes]):
+    """
+    Sends an HTTP response to client.
+    The head and the body are passed to the kernel together with sendmsg, so the body is not
+    copied into a joined response first. Platforms without sendmsg send the joined response instead.
+    """
+
+    head = build_http_response_head(status, headers)
+
+    if type(body) is not bytes:
+        body = body.encode()
+
+    if not SENDMSG_SUPPORTED:
+        client.sendall(head + body)
+        return
+
+    # sendmsg may send only part of the data, the rest is sent with sendall
+    if (sent := client.sendmsg([head, body])) < len(head):
+        client.sendall(memoryview(head)[sent:])
+        sent = len(head)
+
+    client.sendall(memoryview(body)[sent - len(head):])
+
+
+def single_page_application_server(root_directory: str, port: int = 8080, urls: dict = {},
+                                   cache_size: int = 128, cache_file_size: int = Size.mebibyte):
     """
     Serves files from root_directory on a specified port.
     If no urls are specified, every request returns index.html.
+    Up to cache_size files are kept in memory until they are modified.
+    Files larger than cache_file_size are not cached, they are streamed with send_file instead.
     SPA routing should be handled in the front end.
     index.html should be in the root_directory, this is te access point to the SPA.
     urls should be a dictionary where keys are URL paths and values are functions.
@@ -151,65 +441,93 @@ def single_page_application_server(root_directory: str, port: int = 8080, urls:
     assert exists(root_directory)
     assert exists(root_file)
 
-    for client, data in http_client_request_loop(port=port):
+    routes = [(build_regex_url(url), handler) for url, handler in urls.items()]
+    files = {} # path => (modification time, contents, mime type)
+
+    for client, request in http_client_request_loop(port=port):
 
         headers = {'Connection': 'close'}
         status = HTTPStatus.OK
+        body = None
 
         if is_file_url(request['path']):
 
             path = join(root_directory, request['path'][1:])
 
             if exists(path):
-                body = open(path).read()
-                headers['Content-Type'] = get_mime_type(path)
+                if (size := getsize(path)) > cache_file_size:
+                    headers['Content-Type'] = get_mime_type(path)
+                    send_file(client, path, headers, size)
+                else:
+                    body, headers['Content-Type'] = read_cached_file(path, files, cache_size)
 
             else:
-                body = 'File not found'
+                body = FILE_NOT_FOUND_BODY
                 status = HTTPStatus.NOT_FOUND
 
         else:
 
-            for url, handler in urls.items():
-                regex = build_regex_url(url)
+            for regex, handler in routes:
                 if (match := regex.match(request['path'])):
-                    body = handler(request, **match.groupdict()) or open(root_file).read()
+                    body = handler(request, **match.groupdict()) or read_cached_file(root_file, files, cache_size)[0]
                     break
             else:
-                body = open(root_file).read()
-                headers['Content-Type'] = get_mime_type(root_file)
+                body, headers['Content-Type'] = read_cached_file(root_file, files, cache_size)
 
-        response = build_http_response(status, headers, body)
-        client.send(response)
+        if body is not None: # Large files were already sent
+            send_response(client, status, headers, body)
         client.close()
 
         print(status.value, request['method'], request['path'])
 
 
-def web_server(port: int, root_directory: str, urls: dict, static_directory: str = 'static', template_directory: str = 'templates'):
+def web_server(port: int, root_directory: str, urls: dict, static_directory: str = 'static', template_directory: str = 'templates',
+               stream_uploads: bool = False):
+    """
+    Serves static files from static_directory and routes other requests to the views in urls.
+    If stream_uploads is True, multipart/form-data bodies (file uploads) are not read into memory.
+    Views read them from request['body_io'] instead, and request['body'] is left empty.
+    """
 
     assert exists(root_directory)
 
-    file_uploads = {} # client socket FD => boundary
+    exact_routes = {} # URL => handler, for URLs without path variables
+    pattern_routes = {} # URL => handler
 
-    for client, request in http_client_request_loop(port=port):
+    for url, handler in urls.items():
+        parts = [part for part in url.split('/') if part]
+        if any(part.startswith(':') for part in parts):
+            pattern_routes[url] = handler
+        else:
+            exact_routes.setdefault('/' + '/'.join(parts), handler)
+
+    router = RegexRouter(pattern_routes)
+    static_prefix = '/' + static_directory + '/'
+    parameter_binders = {} # view function => function converting client parameters to its kwargs
+
+    for client, request in http_client_request_loop(port=port, stream_body=True):
 
         status = HTTPStatus.NOT_FOUND
         headers = {'Connection': 'close'}
         body = ''
+        file_path = None
+
+        content_type = request.get('content-type', 'text/plain')
+        if not (stream_uploads and content_type.startswith('multipart/form-data')):
+            request['body'] = parse_http_body(request['body_io'].read(), content_type)
 
         #
         # Serve static file
         #
 
-        if is_file_url(request['path']) and request['path'].startswith('/' + static_directory + '/'):
+        if request['path'].startswith(static_prefix) and is_file_url(request['path']):
 
             path = join(root_directory, request['path'][1:])
 
             if exists(path):
                 status = HTTPStatus.OK
                 headers['Content-Type'] = get_mime_type(path)
-                body = open(path).read()
+                file_path = path
 
         #
         # Serve path
@@ -217,92 +535,84 @@ def web_server(port: int, root_directory: str, urls: dict, static_directory: str
 
         else:
 
-            for url, handler in urls.items():
-
-                regex = build_regex_url(url)
-
-                if (match := regex.match(request['path'])):
-
-                    match_group_dict = match.groupdict()
-                    client_parameters = {**match_group_dict, **request['body']}
-
-                    #
-                    # Handle the handler
-                    #
-                    
-                    if callable(handler):
-
-                        function_args = []
-                        function_kwargs = {}
-
-                        if type(handler) is FunctionType:
-                            function = handler
-                            function_args.append(request)
-
-                        else: # Class
-
-                            instance = handler(request)
-                            method = request['method'].lower()
-                            function = getattr(instance, method)
-
-                            if hasattr(instance, 'template'):
-                                if (template_name := getattr(instance, 'template')):
-                                    template_path = join(root_directory, template_directory, template_name)
-                                    body = open(template_path).read()
-
-                        try:
-                            func_sig = signature(function)
-                        except ValueError as error:
-                            raise Exception('Missing self in view method!')
-
-                        for name, param in func_sig.parameters.items():
-                            if name in client_parameters:
-                                value = client_parameters[name]
-                                if param.annotation is not _empty:
-                                    value = param.annotation(value)
-                                function_kwargs[name] = value
-
-                        try:
-                            handler_response = function(*function_args, **function_kwargs)
-                        except TypeError as error:
-                            # Occurs when incorrect function args and/or kwargs were provided
-                            print(error)
-                            handler_response = (HTTPStatus.INTERNAL_SERVER_ERROR, {}, '')
-                        except NotImplementedError:
-                            # Occurs when no view method or template was provided
-                            if not body:
-                                raise
-                            else:
-                                handler_response = (HTTPStatus.OK, {}, body)
-
-                    else:
-                        handler_response = (HTTPStatus.OK, {}, str(handler))
-
-                    #
-                    # Handle the handler response
-                    #
-
-                    if body: # Template is set
-                        if type(handler_response) is tuple and len(handler_response) == 3:
-                            status = handler_response[0]
-                            headers = {**headers, **handler_response[1]}
-                            body = handler_response[2] if handler_response[2] else body
-                        elif handler_response:
-                            status = HTTPStatus.OK
-                            body = handler_response
+            if request['path'] in exact_routes:
+                route = (exact_routes[request['path']], {})
+            else:
+                route = router.match(request['path'])
+
+            if route:
+
+                handler, client_parameters = route
+                client_parameters.update(request['body'])
+
+                #
+                # Handle the handler
+                #
+                
+                if callable(handler):
+
+                    function_args = []
+
+                    if type(handler) is FunctionType:
+                        function = handler
+                        function_args.append(request)
+
+                    else: # Class
+
+                        instance = handler(request)
+                        method = request['method'].lower()
+                        function = getattr(instance, method)
+
+                        if hasattr(instance, 'template'):
+                            if (template_name := getattr(instance, 'template')):
+                                template_path = join(root_directory, template_directory, template_name)
+                                body = open(template_path).read()
+
+                    # Bound methods are cached by their underlying function
+                    key = getattr(function, '__func__', function)
+                    if not (bind := parameter_binders.get(key)):
+                        bind = parameter_binders[key] = get_parameter_binder(function)
+                    function_kwargs = bind(client_parameters)
+
+                    try:
+                        handler_response = function(*function_args, **function_kwargs)
+                    except TypeError as error:
+                        # Occurs when incorrect function args and/or kwargs were provided
+                        print(error)
+                        handler_response = (HTTPStatus.INTERNAL_SERVER_ERROR, {}, '')
+                    except NotImplementedError:
+                        # Occurs when no view method or template was provided
+                        if not body:
+                            raise
                         else:
-                            status = HTTPStatus.OK
+                            handler_response = (HTTPStatus.OK, {}, body)
 
+                else:
+                    handler_response = (HTTPStatus.OK, {}, str(handler))
+
+                #
+                # Handle the handler response
+                #
+
+                if body: # Template is set
+                    if type(handler_response) is tuple and len(handler_response) == 3:
+                        status = handler_response[0]
+                        headers.update(handler_response[1])
+                        body = handler_response[2] if handler_response[2] else body
+                    elif handler_response:
+                        status = HTTPStatus.OK
+                        body = handler_response
                     else:
-                        if type(handler_response) is tuple and len(handler_response) == 3:
-                            status = handler_response[0]
-                            headers = {**headers, **handler_response[1]}
-                            body = handler_response[2]
-                        else:
-                            status = HTTPStatus.OK if handler_response else HTTPStatus.NOT_IMPLEMENTED
-                            body = str(handler_response) or ''
+                        status = HTTPStatus.OK
 
-                    break
+                else:
+                    if type(handler_response) is tuple and len(handler_response) == 3:
+                        status = handler_response[0]
+                        headers.update(handler_response[1])
+                        body = handler_response[2]
+                    else:
+                        status = HTTPStatus.OK if handler_response else HTTPStatus.NOT_IMPLEMENTED
+                        body = str(handler_response) or ''
 
             else:
                 status = HTTPStatus.NOT_FOUND
@@ -312,11 +622,23 @@ def web_server(port: int, root_directory: str, urls: dict, static_directory: str
         # Final touches to the response
         #
 
-        if type(body) in (list, dict):
-            body = dumps(body, indent=2)
+        # Discard any body the view did not read, otherwise closing the socket may reset the connection
+        while request['body_io'].read(8192):
+            pass
+
+        if file_path:
+            send_file(client, file_path, headers)
+
+        else:
+
+            if type(body) in (list, dict):
+                body = dumps(body, indent=2)
+
+            # Content-Length counts bytes, so the body is encoded before measuring it
+            if type(body) is str:
+                body = body.encode()
 
-        headers['Content-Length'] = len(body)
-        response = build_http_response(status, headers, body)
-        client.send(response)
+            headers['Content-Length'] = len(body)
+            send_response(client, status, headers, body)
 
         print(int(status), request['method'], request['path'])
@@ -1,9 +1,24 @@
+from csv import reader
+from functools import partial
+from operator import contains, eq
 from os import kill
 from signal import SIGTERM
 from subprocess import run
 from types import FunctionType
 
 
+PROCESS_FIELDS = ( # (key, converter) for each tasklist csv column, in order
+    ('name', str),
+    ('pid', int),
+    ('session_name', str),
+    ('session_number', int),
+    ('memory_usage', lambda x: int(x.replace(' K', '').replace('ÿ', '').replace(',', '').replace('.', ''))),
+    ('status', str),
+    ('user', str),
+    ('cpu_time', str),
+    ('window_title', str),
+)
+PROCESS_KEYS = tuple(key for key, _ in PROCESS_FIELDS)
 WINDOWS_ENCODING = 'iso-8859-1'
 
 
@@ -42,44 +57,31 @@ def get_processes(**filters) -> list:
     command = run('tasklist /V /NH /FO:CSV', capture_output=True, )
     output = command.stdout.decode(WINDOWS_ENCODING)
 
-    fields = [
-        {'key': 'name', 'type': str},
-        {'key': 'pid', 'type': int},
-        {'key': 'session_name', 'type': str},
-        {'key': 'session_number', 'type': int},
-        {'key': 'memory_usage', 'type': lambda x: int(x.replace(' K', '').replace('ÿ', ''))},
-        {'key': 'status', 'type': str},
-        {'key': 'user', 'type': str},
-        {'key': 'cpu_time', 'type': str},
-        {'key': 'window_title', 'type': lambda x: x[:-1]},
-    ]
-
-    for line in output.split('\n'):
-
-        if not line:
-            continue
-
-        l = line.split(',')
-        p = {f['key']: f['type'](l[i][1:-1]) for i, f in enumerate(fields)}
+    checks = [] # (key, function returning whether the process passes the filter)
 
-        for key, value in filters.items():
-                
-            if key not in p:
-                raise Exception(f'Key "{key}" not found in process dict {list(p.keys())}')
+    for key, value in filters.items():
 
-            if type(value) in (list, tuple):
-                if p[key] not in value:
-                    break
+        if key not in PROCESS_KEYS:
+            raise Exception(f'Key "{key}" not found in process dict {list(PROCESS_KEYS)}')
 
-            elif type(value) is FunctionType:
-                if not value(p[key]):
-                    break
+        if type(value) in (list, tuple):
+            checks.append((key, partial(contains, value)))
 
-            else:
-                if p[key] != value:
-                    break
+        elif type(value) is FunctionType:
+            checks.append((key, value))
 
         else:
+            checks.append((key, partial(eq, value)))
+
+    # csv handles the quoting, including commas inside fields (e.g. "1,234 K")
+    for row in reader(output.splitlines()):
+
+        if not row:
+            continue
+
+        p = {key: convert(value) for (key, convert), value in zip(PROCESS_FIELDS, row)}
+
+        if all(check(p[key]) for key, check in checks):
             result.append(p)
 
     return result
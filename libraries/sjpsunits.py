@@ -1,11 +1,15 @@
 
 class Size:
-    """Size in bytes"""
+    """Size in bytes, decimal (kilobyte = 1000) and binary (kibibyte = 1024) units"""
     byte = 1
-    kilobyte = 1024
-    megabyte = 1024 * 1000
-    gigabyte = 1024 * 1_000_000
-    terabyte = 1024 * 1_000_000_000
+    kilobyte = 1000
+    megabyte = 1_000_000
+    gigabyte = 1_000_000_000
+    terabyte = 1_000_000_000_000
+    kibibyte = 1 << 10
+    mebibyte = 1 << 20
+    gibibyte = 1 << 30
+    tebibyte = 1 << 40
 
 
 class Time:
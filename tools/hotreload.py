@@ -1,12 +1,26 @@
 from argparse import ArgumentParser
 from datetime import datetime
-from os import getcwd, getppid, kill, listdir
-from os.path import basename, isdir, join, splitext
+from os import getcwd, getppid, kill, scandir
+from os.path import basename, join, splitext
 import shlex
 from signal import SIGTERM
 from subprocess import run, Popen, PIPE, TimeoutExpired
+from threading import Event
 from time import sleep
 
+try:
+    from os import killpg
+    from signal import SIGKILL
+except ImportError: # Windows
+    killpg = None
+
+try:
+    # Optional, used for change notifications from the OS instead of polling
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
 
 parser = ArgumentParser(
     prog='hotreload',
@@ -55,15 +69,20 @@ root_directory = root_directory.replace('"', '')
 root_directory = root_directory.replace('\\.', '')
 
 
-def get_files(path: str, file_types: list) -> list:
-    result: list = []
+def get_file_stats(path: str, file_types: list) -> dict:
+    """
+    Returns the modification time and size of every file in path (recursively) with a type in file_types.
+    Uses os.scandir, which gets the file type from the directory listing itself.
+    """
+    result: dict = {}
     try:
-        for file in listdir(path):
-            file_path = join(path, file)
-            if isdir(file_path):
-                result += get_files(file_path, file_types)
-            elif splitext(file_path)[1] in file_types:
-                result.append(file_path)
+        with scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    result.update(get_file_stats(entry.path, file_types))
+                elif splitext(entry.name)[1] in file_types:
+                    stat = entry.stat()
+                    result[entry.path] = (stat.st_mtime_ns, stat.st_size)
     except PermissionError:
         print('No permission:', path)
     except Exception as e:
@@ -71,13 +90,6 @@ def get_files(path: str, file_types: list) -> list:
     return result
 
 
-def get_and_read_files(path: str, file_types: list) -> dict:
-    result: dict = {}
-    for file in get_files(path, file_types):
-        result[file] = open(file).read()
-    return result
-
-
 def run_scripts(scripts: list, log_stdout: bool) -> list:
     procs = []
     now = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
@@ -88,16 +100,53 @@ def run_scripts(scripts: list, log_stdout: bool) -> list:
             print(basename(script), completed.stdout or None, end='')
             if not completed.stdout.endswith('\n'):
                 print()"""
-        proc = Popen(script, stdout=PIPE)
+        proc = Popen(script, stdout=PIPE, start_new_session=True)
         procs.append(proc)
     return procs
 
 
+def start_observer(path: str, file_types: list, changed: Event):
+    """
+    Starts a watchdog Observer for path (recursively).
+    changed is set when a file with a type in file_types is created, modified, moved or deleted.
+    """
+
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory or event.event_type not in ('created', 'modified', 'moved', 'deleted'):
+                return
+            for file in (event.src_path, getattr(event, 'dest_path', '')):
+                if file and splitext(file)[1] in file_types:
+                    changed.set()
+
+    observer = Observer()
+    observer.schedule(ChangeHandler(), path, recursive=True)
+    observer.start()
+    return observer
+
+
 def kill_procs(procs):
-    for i in range(len(procs)):
-        p = procs[i]
-        p.kill()
-        del procs[i]
+    """Terminates the processes in procs together with their child processes and empties procs"""
+    for p in procs:
+        try:
+            if killpg:
+                # Scripts are started in their own session, so the process group id is the pid
+                killpg(p.pid, SIGTERM)
+            else:
+                # /T ends the child processes too
+                run(f'taskkill /F /T /PID {p.pid}', capture_output=True)
+        except ProcessLookupError:
+            pass
+        try:
+            p.wait(timeout=1)
+        except TimeoutExpired:
+            # The script ignored SIGTERM, the whole group is killed so its children do not linger
+            try:
+                killpg(p.pid, SIGKILL) if killpg else p.kill()
+            except ProcessLookupError:
+                pass
+            p.wait()
+    procs.clear()
 
 
 procs: list = []
@@ -105,18 +154,35 @@ procs: list = []
 try:
 
     procs = run_scripts(scripts, bool(args.log))
-    old_files = get_and_read_files(root_directory, file_types)
 
-    while True:
+    if Observer:
+
+        changed = Event()
+        observer = start_observer(root_directory, file_types, changed)
+
+        while True:
+
+            # wait has a timeout to let KeyboardInterrupt through
+            if changed.wait(0.5):
+                sleep(0.05) # Saving a file often fires several events, let them settle
+                changed.clear()
+                kill_procs(procs)
+                procs = run_scripts(scripts, bool(args.log))
+
+    else:
+
+        old_files = get_file_stats(root_directory, file_types)
+
+        while True:
 
-        new_files = get_and_read_files(root_directory, file_types)
+            new_files = get_file_stats(root_directory, file_types)
 
-        if new_files != old_files:
-            kill_procs(procs)
-            procs = run_scripts(scripts, bool(args.log))
+            if new_files != old_files:
+                kill_procs(procs)
+                procs = run_scripts(scripts, bool(args.log))
 
-        old_files = {**new_files}
-        sleep(0.2)
+            old_files = {**new_files}
+            sleep(0.2)
 
 except KeyboardInterrupt:
     pass